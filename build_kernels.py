@@ -0,0 +1,15 @@
+# build_kernels.py
+# AOT-compile kernels.py into the swap_kernels extension module:
+#   python build_kernels.py
+# kernels.py picks it up automatically; without it the kernels are JIT-compiled at import.
+from numba.pycc import CC
+
+import kernels
+
+cc = CC("swap_kernels")
+cc.export("vwap_f64", "f8(f8[:], f8[:], i8)")(kernels._vwap)
+cc.export("decode_v2_amounts", "UniTuple(f8, 4)(u1[:])")(kernels._decode_v2_amounts)
+cc.export("decode_v3_amounts", "UniTuple(f8, 2)(u1[:])")(kernels._decode_v3_amounts)
+
+if __name__ == "__main__":
+    cc.compile()
@@ -0,0 +1,123 @@
+# common.py
+# Config and constants shared by price.py and spotprice.py (resolved once per process).
+import asyncio
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from Crypto.Hash import keccak
+
+# -------------------
+# Config
+# -------------------
+# .env is a local-dev convenience: skip the file lookup (and the dotenv import) when the
+# environment already provides the endpoint, as it does in production.
+if "INFURA_WSS" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+INFURA_WSS = os.environ.get("INFURA_WSS", "wss://mainnet.infura.io/ws/v3/cggggggggggggf944a3aa24b550be5f479e")
+# spot eth_calls go over HTTPS so they never queue behind subscription frames on the WSS
+INFURA_HTTPS = os.environ.get("INFURA_HTTPS") or INFURA_WSS.replace("wss://", "https://").replace("/ws/v3/", "/v3/")
+
+# -------------------
+# Addresses / Decimals (Ethereum mainnet)
+# -------------------
+USDT = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
+USDT_DECIMALS = 6
+WETH_DECIMALS = 18
+
+# Uniswap V2 WETH/USDT pair (token0=WETH, token1=USDT)
+UNISWAP_V2_POOL = "0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852"
+
+# Uniswap V3 WETH/USDT 0.05% pool (token0=WETH, token1=USDT)
+UNISWAP_V3_POOL = "0x11b815efB8f581194ae79006d24E0d814B7697F6"
+
+# Divisors, hoisted out of the per-swap path
+USDT_SCALE = 10 ** USDT_DECIMALS
+ETH_SCALE  = 10 ** WETH_DECIMALS
+INV_USDT_SCALE = 1.0 / USDT_SCALE
+INV_ETH_SCALE  = 1.0 / ETH_SCALE
+
+# -------------------
+# Event topics (keccak of the signature)
+# -------------------
+def kec(t: bytes) -> bytes:
+    # Keccak-256 via pycryptodome's C extension
+    h = keccak.new(digest_bits=256)
+    h.update(t)
+    return h.digest()
+
+TRANSFER_TOPIC = "0x" + kec(b"Transfer(address,address,uint256)").hex()
+V2_SWAP_TOPIC  = "0x" + kec(b"Swap(address,uint256,uint256,uint256,uint256,address)").hex()
+V3_SWAP_TOPIC  = "0x" + kec(b"Swap(address,address,int256,int256,uint160,uint128,int24)").hex()
+
+# -------------------
+# Console output / supervision
+# -------------------
+log = logging.getLogger("swaps")
+
+def start_log_listener() -> QueueListener:
+    # stdout writes happen on the listener's thread, never on the event loop
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    q: queue.Queue = queue.Queue(-1)
+    listener = QueueListener(q, handler)
+    log.addHandler(QueueHandler(q))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
+
+async def reconnect_after(delay: float, coro):
+    await asyncio.sleep(delay)
+    return await coro
+
+# -------------------
+# Log stream (history + live, across reconnects)
+# -------------------
+BACKFILL_BLOCKS = 50  # history replayed on the first connect
+GET_LOGS_STRIDE = 10  # blocks per eth_getLogs (USDT alone emits hundreds of Transfers per block)
+
+class LogStream:
+    # One logs subscription that outlives its sockets: every connect subscribes first, then replays
+    # eth_getLogs from the last fully delivered block + 1 (the last BACKFILL_BLOCKS on the first
+    # connect) up to head, so nothing mined before or during an outage is missed. Logs at or below
+    # that block, or already yielded past it, are skipped on (transactionHash, logIndex).
+    def __init__(self, flt: dict):
+        self.flt = flt
+        self.synced = -1  # every log up to this block has been yielded
+        self.delivered: dict = {}  # (transactionHash, logIndex) -> block, for blocks past synced
+
+    def _fresh(self, ev) -> bool:
+        key = (ev["transactionHash"], ev["logIndex"])
+        if ev["blockNumber"] <= self.synced or key in self.delivered:
+            return False
+        self.delivered[key] = ev["blockNumber"]
+        return True
+
+    def _advance(self, block: int):
+        if block > self.synced:
+            self.synced = block
+            self.delivered = {k: b for k, b in self.delivered.items() if b > block}
+
+    async def logs(self, w3):
+        await w3.eth.subscribe("logs", self.flt)
+        latest = await w3.eth.block_number
+        start = latest - BACKFILL_BLOCKS if self.synced < 0 else self.synced + 1
+        log.info(f"[Info] Subscribed. Replaying blocks {start}..{latest}.")
+        for lo in range(max(0, start), latest + 1, GET_LOGS_STRIDE):
+            hi = min(lo + GET_LOGS_STRIDE - 1, latest)
+            for ev in await w3.eth.get_logs({"fromBlock": lo, "toBlock": hi, **self.flt}):
+                if self._fresh(ev):
+                    yield ev
+        self._advance(latest)
+
+        async for msg in w3.ws.process_subscriptions():
+            ev = msg["result"]
+            if self._fresh(ev):
+                yield ev
+            # block n may still have logs in flight; n-1 is complete
+            self._advance(ev["blockNumber"] - 1)
@@ -0,0 +1,66 @@
+# kernels.py
+# Hot-path math shared by price.py and spotprice.py (single source of truth).
+# Plain Python source compiled one of two ways:
+#   - AOT: `python build_kernels.py` writes swap_kernels.*.so next to this file (no JIT cost at startup)
+#   - JIT: numba @njit fallback below when the AOT module hasn't been built
+# JIT builds are cached on disk (cache=True); set NUMBA_CACHE_DIR to put the cache somewhere shippable.
+import warnings
+
+import numpy as np
+from numba import njit
+
+
+# ------------------- 32-byte ABI words → float64 -------------------
+@njit(cache=True)
+def _uint_word(data, off):
+    v = 0.0
+    for i in range(off, off + 32):
+        v = v * 256.0 + data[i]
+    return v
+
+@njit(cache=True)
+def _int_word(data, off):
+    # two's complement: negative value is -(~x + 1), accumulated on the inverted bytes to keep precision
+    if data[off] < 0x80:
+        return _uint_word(data, off)
+    v = 0.0
+    for i in range(off, off + 32):
+        v = v * 256.0 + (255 - data[i])
+    return -(v + 1.0)
+
+
+# ------------------- kernels -------------------
+def _vwap(prices, sizes, n):
+    # single fused pass; VWAP is order-independent so ring order doesn't matter
+    num = 0.0; den = 0.0
+    for i in range(n):
+        num += prices[i] * sizes[i]
+        den += sizes[i]
+    return num / den if den else 0.0
+
+def _decode_v2_amounts(data):
+    # V2 Swap data: amount0In, amount1In, amount0Out, amount1Out (uint256)
+    return _uint_word(data, 0), _uint_word(data, 32), _uint_word(data, 64), _uint_word(data, 96)
+
+def _decode_v3_amounts(data):
+    # V3 Swap data: amount0, amount1 (int256); sqrtPriceX96/liquidity/tick are not needed
+    return _int_word(data, 0), _int_word(data, 32)
+
+
+try:
+    from swap_kernels import vwap_f64, decode_v2_amounts, decode_v3_amounts
+except ImportError:
+    vwap_f64 = njit(cache=True, fastmath=True)(_vwap)
+    decode_v2_amounts = njit(cache=True)(_decode_v2_amounts)
+    decode_v3_amounts = njit(cache=True)(_decode_v3_amounts)
+
+    # compile (or load from cache) now, before any stream opens, not on the first swap. The decoders
+    # are fed np.frombuffer(log data), i.e. read-only arrays, which numba types separately from
+    # writable ones -- warm up with the same kind or the first real swap compiles again
+    try:
+        vwap_f64(np.zeros(1), np.zeros(1), 0)
+        decode_v2_amounts(np.frombuffer(bytes(128), np.uint8))
+        decode_v3_amounts(np.frombuffer(bytes(64), np.uint8))
+    except Exception as e:
+        # e.g. read-only cache dir; the kernels still compile lazily on first call
+        warnings.warn(f"numba warm-up failed, compiling on first use: {e}")
@@ -1,78 +1,32 @@
-# pip install web3==6.* python-dotenv
-import os
-import time
+# pip install web3==6.* python-dotenv numpy numba pycryptodome
+import asyncio
 from collections import deque
 from dataclasses import dataclass
-from typing import Deque, Dict, Any, Optional
+from itertools import cycle
+from typing import Deque, Dict, Any, List, Optional
 
-from dotenv import load_dotenv
-from web3 import Web3
+import numpy as np
+from eth_abi import decode
+from web3 import AsyncWeb3, Web3, WebsocketProviderV2
 
-load_dotenv()
-
-INFURA_WSS = os.getenv("INFURA_WSS", "wss://mainnet.infura.io/ws/v3/cggggggggggggf944a3aa24b550be5f479e")
-
-# -------------------
-# Addresses / Decimals
-# -------------------
-USDT = Web3.to_checksum_address("0xdAC17F958D2ee523a2206206994597C13D831ec7")
-USDT_DECIMALS = 6
-
-# Uniswap V2 WETH/USDT pair (token0=WETH, token1=USDT)
-UNISWAP_V2_POOL = Web3.to_checksum_address("0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852")
-
-# Uniswap V3 WETH/USDT 0.05% pool (token0=WETH, token1=USDT)
-UNISWAP_V3_POOL = Web3.to_checksum_address("0x11b815efB8f581194ae79006d24E0d814B7697F6")
+from common import (
+    INFURA_WSS, USDT, UNISWAP_V2_POOL, UNISWAP_V3_POOL,
+    USDT_SCALE, INV_USDT_SCALE, INV_ETH_SCALE,
+    TRANSFER_TOPIC, V2_SWAP_TOPIC, V3_SWAP_TOPIC,
+    LogStream, log, reconnect_after, start_log_listener,
+)
+from kernels import decode_v2_amounts, decode_v3_amounts
 
 # -------------------
-# Minimal ABIs
+# Event data layouts (non-indexed args only; indexed args live in topics[1:])
+# Swap layouts are decoded by kernels.decode_v2_amounts / decode_v3_amounts.
 # -------------------
-USDT_ABI = [
-    {
-        "anonymous": False,
-        "inputs": [
-            {"indexed": True,  "name": "from",  "type": "address"},
-            {"indexed": True,  "name": "to",    "type": "address"},
-            {"indexed": False, "name": "value", "type": "uint256"},
-        ],
-        "name": "Transfer",
-        "type": "event",
-    }
-]
-
-UNIV2_SWAP_EVENT_ABI = {
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True,  "name": "sender",    "type": "address"},
-        {"indexed": False, "name": "amount0In", "type": "uint256"},
-        {"indexed": False, "name": "amount1In", "type": "uint256"},
-        {"indexed": False, "name": "amount0Out","type": "uint256"},
-        {"indexed": False, "name": "amount1Out","type": "uint256"},
-        {"indexed": True,  "name": "to",        "type": "address"},
-    ],
-    "name": "Swap",
-    "type": "event",
-}
-
-UNIV3_SWAP_EVENT_ABI = {
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True,  "name": "sender",        "type": "address"},
-        {"indexed": True,  "name": "recipient",     "type": "address"},
-        {"indexed": False, "name": "amount0",       "type": "int256"},
-        {"indexed": False, "name": "amount1",       "type": "int256"},
-        {"indexed": False, "name": "sqrtPriceX96",  "type": "uint160"},
-        {"indexed": False, "name": "liquidity",     "type": "uint128"},
-        {"indexed": False, "name": "tick",          "type": "int24"},
-    ],
-    "name": "Swap",
-    "type": "event",
-}
+TRANSFER_TYPES = ("uint256",)                                        # value
 
 # -------------------
 # Dataclasses
 # -------------------
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TransferDetails:
     block: int
     tx_hash: str
@@ -80,7 +34,8 @@ class TransferDetails:
     recipient: str
     amount: float  # human (6 decimals)
 
-@dataclass
+# Mutable: instances are recycled from a per-decoder pool (see _V2_SLOTS / _V3_SLOTS)
+@dataclass(slots=True)
 class SwapDetails:
     block: int
     tx_hash: str
@@ -89,165 +44,210 @@ class SwapDetails:
     usdt: float    # absolute USDT amount traded
     price: float   # USDT per 1 ETH
 
+# Decoded events wait here for the printer. Bounded so a recycled SwapDetails can never
+# still be queued: a decoder's live objects are at most EVENT_QUEUE_SIZE queued
+# + 1 being printed + 1 being decoded.
+EVENT_QUEUE_SIZE = 32
+_V2_SLOTS = cycle([SwapDetails(0, "", "UniswapV2", 0.0, 0.0, 0.0) for _ in range(EVENT_QUEUE_SIZE + 2)])
+_V3_SLOTS = cycle([SwapDetails(0, "", "UniswapV3 0.05%", 0.0, 0.0, 0.0) for _ in range(EVENT_QUEUE_SIZE + 2)])
+
 
 # -------------------
 # Helpers
 # -------------------
 def human_usdt(value_wei_like: int) -> float:
-    return value_wei_like / (10 ** USDT_DECIMALS)
-
-def safe_avg(values) -> Optional[float]:
-    vals = [v for v in values if v and v != float("inf")]
-    return sum(vals) / len(vals) if vals else None
-
+    return value_wei_like / USDT_SCALE
+
+# Fixed-size float64 window; buf[:n] holds the live values (ring order)
+class RingBuf:
+    __slots__ = ("buf", "idx", "n")
+
+    def __init__(self, size: int):
+        self.buf = np.empty(size, np.float64)
+        self.idx = 0
+        self.n = 0
+
+    def push(self, v: float):
+        self.buf[self.idx] = v
+        self.idx = (self.idx + 1) % self.buf.size
+        self.n = min(self.n + 1, self.buf.size)
+
+    def total(self) -> float:
+        return float(self.buf[:self.n].sum())
+
+VENUE_V2, VENUE_V3 = 0, 1
+
+class PriceWindow:
+    # Recent swap prices of both venues in one buffer, tagged by a parallel venue array (SoA);
+    # per-venue and combined averages are masked reductions over the same 10 slots.
+    __slots__ = ("prices", "venues", "idx")
+
+    def __init__(self, size: int):
+        self.prices = np.full(size, np.nan)
+        self.venues = np.zeros(size, np.uint8)
+        self.idx = 0
+
+    def push(self, venue: int, px: float):
+        self.prices[self.idx] = px
+        self.venues[self.idx] = venue
+        self.idx = (self.idx + 1) % self.prices.size
+
+    def avg(self, venue: Optional[int] = None, last: int = 5) -> Optional[float]:
+        # oldest→newest, so [-last:] is the most recent swaps (of that venue, if given)
+        px = np.roll(self.prices, -self.idx)
+        if venue is not None:
+            px = px[np.roll(self.venues, -self.idx) == venue]
+        px = px[-last:]
+        m = np.isfinite(px) & (px != 0)  # skips unfilled (nan) slots and zero-delta (inf) prices
+        return float(px[m].mean()) if m.any() else None
 
 # -------------------
 # Decoders
 # -------------------
-def decode_transfer(contract, log) -> TransferDetails:
-    ev = contract.events.Transfer().process_log(log)
-    amount_raw = int(ev["args"]["value"])
+def decode_transfer(log) -> TransferDetails:
+    # topics: [sig, from, to]
+    (amount_raw,) = decode(TRANSFER_TYPES, log["data"])
     return TransferDetails(
         block=log["blockNumber"],
         tx_hash=log["transactionHash"].hex(),
-        sender=ev["args"]["from"],
-        recipient=ev["args"]["to"],
+        sender=Web3.to_checksum_address(log["topics"][1][-20:]),
+        recipient=Web3.to_checksum_address(log["topics"][2][-20:]),
         amount=human_usdt(amount_raw)
     )
 
-def decode_swap_v2(contract, log) -> SwapDetails:
+def decode_swap_v2(log) -> SwapDetails:
     # token0=WETH, token1=USDT for this pool
-    ev = contract.events.Swap().process_log(log)
-    eth_delta  = int(ev["args"]["amount0In"]) - int(ev["args"]["amount0Out"])  # +ve => pool received ETH
-    usdt_delta = int(ev["args"]["amount1In"]) - int(ev["args"]["amount1Out"])  # +ve => pool received USDT
-
-    eth  = abs(Web3.from_wei(eth_delta, "ether"))
-    usdt = abs(human_usdt(usdt_delta))
-    price = (usdt / eth) if eth else float("inf")
-
-    return SwapDetails(
-        block=log["blockNumber"],
-        tx_hash=log["transactionHash"].hex(),
-        pool="UniswapV2",
-        eth=float(eth),
-        usdt=float(usdt),
-        price=float(price),
-    )
-
-def decode_swap_v3(contract, log) -> SwapDetails:
+    a0in, a1in, a0out, a1out = decode_v2_amounts(np.frombuffer(log["data"], np.uint8))
+    eth_delta  = a0in - a0out  # +ve => pool received ETH
+    usdt_delta = a1in - a1out  # +ve => pool received USDT
+
+    eth  = abs(eth_delta) * INV_ETH_SCALE
+    usdt = abs(usdt_delta) * INV_USDT_SCALE
+    price = (usdt / eth) if eth_delta else float("inf")
+
+    s = next(_V2_SLOTS)
+    s.block = log["blockNumber"]
+    s.tx_hash = log["transactionHash"].hex()
+    s.eth = eth
+    s.usdt = usdt
+    s.price = price
+    return s
+
+def decode_swap_v3(log) -> SwapDetails:
     # token0=WETH, token1=USDT for this pool
-    ev = contract.events.Swap().process_log(log)
-    amount0 = int(ev["args"]["amount0"])  # signed
-    amount1 = int(ev["args"]["amount1"])  # signed
+    amount0, amount1 = decode_v3_amounts(np.frombuffer(log["data"], np.uint8))  # signed
 
-    eth  = abs(Web3.from_wei(amount0, "ether"))
-    usdt = abs(human_usdt(amount1))
-    price = (usdt / eth) if eth else float("inf")
+    eth  = abs(amount0) * INV_ETH_SCALE
+    usdt = abs(amount1) * INV_USDT_SCALE
+    price = (usdt / eth) if amount0 else float("inf")
 
-    return SwapDetails(
-        block=log["blockNumber"],
-        tx_hash=log["transactionHash"].hex(),
-        pool="UniswapV3 0.05%",
-        eth=float(eth),
-        usdt=float(usdt),
-        price=float(price),
-    )
+    s = next(_V3_SLOTS)
+    s.block = log["blockNumber"]
+    s.tx_hash = log["transactionHash"].hex()
+    s.eth = eth
+    s.usdt = usdt
+    s.price = price
+    return s
 
 
 # -------------------
-# Main
+# Streams
 # -------------------
-def main():
-    w3 = Web3(Web3.WebsocketProvider(INFURA_WSS, websocket_timeout=60))
-    assert w3.is_connected(), "Not connected. Check INFURA_WSS / internet."
-
-    latest_block = w3.eth.block_number
-    from_block = max(0, latest_block - 50)
-    print(f"Connected. Latest block {latest_block}. Watching from {from_block}…")
-
-    # Contracts
-    usdt = w3.eth.contract(address=USDT, abi=USDT_ABI)
-    univ2 = w3.eth.contract(address=UNISWAP_V2_POOL, abi=[UNIV2_SWAP_EVENT_ABI])
-    univ3 = w3.eth.contract(address=UNISWAP_V3_POOL, abi=[UNIV3_SWAP_EVENT_ABI])
+# One subscription carries every watched event; dispatch is a single dict lookup.
+# Keyed on (address, topic0), not topic0 alone: the V2 pair is itself an ERC-20 and emits Transfer too.
+HANDLERS = {
+    (USDT,            bytes.fromhex(TRANSFER_TOPIC[2:])): decode_transfer,
+    (UNISWAP_V2_POOL, bytes.fromhex(V2_SWAP_TOPIC[2:])):  decode_swap_v2,
+    (UNISWAP_V3_POOL, bytes.fromhex(V3_SWAP_TOPIC[2:])):  decode_swap_v3,
+}
+WATCHED_ADDRESSES = frozenset(address for address, _ in HANDLERS)
+LOGS_FILTER = {
+    "address": sorted(WATCHED_ADDRESSES),
+    "topics": [[TRANSFER_TOPIC, V2_SWAP_TOPIC, V3_SWAP_TOPIC]],  # topic0 is any of these
+}
 
-    # Topics
-    transfer_topic = w3.keccak(text="Transfer(address,address,uint256)").hex()
-    v2_swap_topic  = w3.keccak(text="Swap(address,uint256,uint256,uint256,uint256,address)").hex()
-    v3_swap_topic  = w3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)").hex()
+async def run_stream(out: asyncio.Queue, stream: LogStream):
+    async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(INFURA_WSS)) as w3:
+        async for ev in stream.logs(w3):
+            handler = HANDLERS.get((ev["address"], ev["topics"][0]))
+            if handler:
+                await out.put(handler(ev))
+    raise ConnectionError("subscription closed")
 
-    # Filters
-    transfer_filter = w3.eth.filter({"fromBlock": from_block, "address": USDT,             "topics": [transfer_topic]})
-    v2_filter       = w3.eth.filter({"fromBlock": from_block, "address": UNISWAP_V2_POOL,  "topics": [v2_swap_topic]})
-    v3_filter       = w3.eth.filter({"fromBlock": from_block, "address": UNISWAP_V3_POOL,  "topics": [v3_swap_topic]})
 
+async def printer(q: asyncio.Queue):
     # Rolling windows
-    last5_transfers: Deque[TransferDetails] = deque(maxlen=5)
+    last5_amounts = RingBuf(5)
     last50_transfers: Deque[TransferDetails] = deque(maxlen=50)
 
-    last5_v2_prices: Deque[float] = deque(maxlen=5)
-    last5_v3_prices: Deque[float] = deque(maxlen=5)
-    last5_all_prices: Deque[float] = deque(maxlen=5)
+    prices = PriceWindow(10)
+
+    def render(item, out: List[str]):
+        # --- USDT Transfers ---
+        if isinstance(item, TransferDetails):
+            td = item
+            last50_transfers.append(td)
+            last5_amounts.push(td.amount)
+            out.append(f"[Transfer] {td.amount:,.2f} USDT {td.sender} -> {td.recipient} (blk {td.block})")
+            total5 = last5_amounts.total()
+            out.append(f"  ↳ Last 5 transfer total: {total5:,.2f} USDT")
+            return
+
+        # --- Uniswap V2 / V3 Swaps ---
+        s = item
+        if s.pool == "UniswapV2":
+            prices.push(VENUE_V2, s.price)
+            out.append(f"[Swap V2] {s.eth:.6f} ETH ⇄ {s.usdt:,.2f} USDT | Price={s.price:,.2f} USDT/ETH (blk {s.block})")
+        else:
+            prices.push(VENUE_V3, s.price)
+            out.append(f"[Swap V3] {s.eth:.6f} ETH ⇄ {s.usdt:,.2f} USDT | Price={s.price:,.2f} USDT/ETH (blk {s.block})")
+
+        # --- Rolling averages (only print when we have enough points) ---
+        v2_avg = prices.avg(VENUE_V2)
+        v3_avg = prices.avg(VENUE_V3)
+        all_avg = prices.avg()
+
+        if v2_avg is not None:
+            out.append(f"  ↳ V2 last-5 avg price: {v2_avg:,.2f} USDT/ETH")
+        if v3_avg is not None:
+            out.append(f"  ↳ V3 last-5 avg price: {v3_avg:,.2f} USDT/ETH")
+        if all_avg is not None:
+            out.append(f"  ↳ Combined last-5 avg price: {all_avg:,.2f} USDT/ETH")
+
+    while True:
+        # drain whatever is already queued and emit the burst as one record (one stdout write)
+        out: List[str] = []
+        render(await q.get(), out)
+        while not q.empty():
+            render(q.get_nowait(), out)
+        log.info("\n".join(out))
+
+
+# -------------------
+# Main
+# -------------------
+async def supervise():
+    q: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+    printer_task = asyncio.create_task(printer(q))
+    stream = LogStream(LOGS_FILTER)
+    stream_task = asyncio.create_task(run_stream(q, stream))
+    log.info("Connecting stream…")
 
     while True:
-        try:
-            # --- USDT Transfers ---
-            for log in transfer_filter.get_new_entries():
-                td = decode_transfer(usdt, log)
-                last50_transfers.append(td)
-                last5_transfers.append(td)
-                print(f"[Transfer] {td.amount:,.2f} USDT {td.sender} -> {td.recipient} (blk {td.block})")
-
-            if len(last5_transfers):
-                total5 = sum(t.amount for t in last5_transfers)
-                print(f"  ↳ Last 5 transfer total: {total5:,.2f} USDT")
-
-            # --- Uniswap V2 Swaps ---
-            for log in v2_filter.get_new_entries():
-                s = decode_swap_v2(univ2, log)
-                last5_v2_prices.append(s.price)
-                last5_all_prices.append(s.price)
-                print(f"[Swap V2] {s.eth:.6f} ETH ⇄ {s.usdt:,.2f} USDT | Price={s.price:,.2f} USDT/ETH (blk {s.block})")
-
-            # --- Uniswap V3 Swaps ---
-            for log in v3_filter.get_new_entries():
-                s = decode_swap_v3(univ3, log)
-                last5_v3_prices.append(s.price)
-                last5_all_prices.append(s.price)
-                print(f"[Swap V3] {s.eth:.6f} ETH ⇄ {s.usdt:,.2f} USDT | Price={s.price:,.2f} USDT/ETH (blk {s.block})")
-
-            # --- Rolling averages (only print when we have enough points) ---
-            v2_avg = safe_avg(last5_v2_prices)
-            v3_avg = safe_avg(last5_v3_prices)
-            all_avg = safe_avg(last5_all_prices)
-
-            if v2_avg is not None:
-                print(f"  ↳ V2 last-5 avg price: {v2_avg:,.2f} USDT/ETH")
-            if v3_avg is not None:
-                print(f"  ↳ V3 last-5 avg price: {v3_avg:,.2f} USDT/ETH")
-            if all_avg is not None:
-                print(f"  ↳ Combined last-5 avg price: {all_avg:,.2f} USDT/ETH")
-
-            time.sleep(2)
-
-        except Exception as e:
-            # Common causes: provider hiccup, filter ID not found, temporary disconnect
-            print(f"[Warn] Poll loop error: {e}. Reconnecting in 5s…")
-            time.sleep(5)
-            try:
-                # Rebuild provider and filters on failure
-                w3 = Web3(Web3.WebsocketProvider(INFURA_WSS, websocket_timeout=60))
-                usdt = w3.eth.contract(address=USDT, abi=USDT_ABI)
-                univ2 = w3.eth.contract(address=UNISWAP_V2_POOL, abi=[UNIV2_SWAP_EVENT_ABI])
-                univ3 = w3.eth.contract(address=UNISWAP_V3_POOL, abi=[UNIV3_SWAP_EVENT_ABI])
-                latest_block = w3.eth.block_number
-                from_block = max(0, latest_block - 50)
-                transfer_filter = w3.eth.filter({"fromBlock": from_block, "address": USDT,            "topics": [transfer_topic]})
-                v2_filter       = w3.eth.filter({"fromBlock": from_block, "address": UNISWAP_V2_POOL, "topics": [v2_swap_topic]})
-                v3_filter       = w3.eth.filter({"fromBlock": from_block, "address": UNISWAP_V3_POOL, "topics": [v3_swap_topic]})
-                print("[Info] Reconnected and filters recreated.")
-            except Exception as e2:
-                print(f"[Error] Reconnect failed: {e2}. Retrying…")
-                time.sleep(5)
+        done, _ = await asyncio.wait([printer_task, stream_task], return_when=asyncio.FIRST_EXCEPTION)
+        if printer_task in done:
+            printer_task.result()  # re-raise; printer never returns on its own
+        # Common causes: provider hiccup, temporary disconnect
+        log.warning(f"[Warn] Stream error: {stream_task.exception()}. Resubscribing in 5s…")
+        stream_task = asyncio.create_task(reconnect_after(5, run_stream(q, stream)))
+
+
+def main():
+    listener = start_log_listener()
+    try:
+        asyncio.run(supervise())
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
@@ -1,56 +1,30 @@
 # eth_usdt_v2_v3_prices.py
-# pip install web3==6.* python-dotenv
-import os, time, math
-from collections import deque
-from typing import Deque, Tuple, Optional
-from dotenv import load_dotenv
-from web3 import Web3
-
-load_dotenv()
-INFURA_WSS = os.getenv("INFURA_WSS", "wss://mainnet.infura.io/ws/v3/cf939ggg6e62f944gggggggggggggg550be5f479e")
+# pip install web3==6.* python-dotenv numpy numba pycryptodome
+import asyncio, math
+from typing import Dict, List, Tuple, Optional
+import numpy as np
+from eth_abi import decode
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3, WebsocketProviderV2
+from common import (
+    INFURA_WSS, INFURA_HTTPS, USDT_DECIMALS, WETH_DECIMALS, UNISWAP_V2_POOL, UNISWAP_V3_POOL,
+    USDT_SCALE, ETH_SCALE, INV_USDT_SCALE, INV_ETH_SCALE, V2_SWAP_TOPIC, V3_SWAP_TOPIC,
+    LogStream, log, reconnect_after, start_log_listener,
+)
+from kernels import decode_v2_amounts, decode_v3_amounts, vwap_f64
 
 # ------------------- constants (Ethereum mainnet) -------------------
-USDT_DECIMALS = 6
-WETH_DECIMALS = 18
-
-# Uniswap V2: WETH/USDT (token0=WETH, token1=USDT)
-UNISWAP_V2_POOL = Web3.to_checksum_address("0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852")
+_V3_NUM_MULT = 10 ** (WETH_DECIMALS - USDT_DECIMALS)
+_V3_DEN = 1 << 192
 
-# Uniswap V3 0.05%: WETH/USDT (token0=WETH, token1=USDT)
-UNISWAP_V3_POOL = Web3.to_checksum_address("0x11b815efB8f581194ae79006d24E0d814B7697F6")
+# Multicall3 (same address on every EVM chain)
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"
 
 VWAP_WINDOW = 20              # last N swaps for VWAP
 SPOT_INTERVAL_SEC = 10        # print spot this often
 DEVIATION_WARN_PCT = 1.0      # warn if |VWAP-Spot| > this %
 
 # ------------------- ABIs (minimal) -------------------
-UNIV2_SWAP_EVENT_ABI = {
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True,  "name": "sender",    "type": "address"},
-        {"indexed": False, "name": "amount0In", "type": "uint256"},
-        {"indexed": False, "name": "amount1In", "type": "uint256"},
-        {"indexed": False, "name": "amount0Out","type": "uint256"},
-        {"indexed": False, "name": "amount1Out","type": "uint256"},
-        {"indexed": True,  "name": "to",        "type": "address"},
-    ],
-    "name": "Swap",
-    "type": "event",
-}
-UNIV3_SWAP_EVENT_ABI = {
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True,  "name": "sender",        "type": "address"},
-        {"indexed": True,  "name": "recipient",     "type": "address"},
-        {"indexed": False, "name": "amount0",       "type": "int256"},
-        {"indexed": False, "name": "amount1",       "type": "int256"},
-        {"indexed": False, "name": "sqrtPriceX96",  "type": "uint160"},
-        {"indexed": False, "name": "liquidity",     "type": "uint128"},
-        {"indexed": False, "name": "tick",          "type": "int24"},
-    ],
-    "name": "Swap",
-    "type": "event",
-}
 UNIV2_PAIR_ABI_MIN = [
     {"name": "getReserves", "outputs": [
         {"type": "uint112", "name": "_reserve0"},
@@ -58,6 +32,20 @@ UNIV2_PAIR_ABI_MIN = [
         {"type": "uint32",  "name": "_blockTimestampLast"}
     ], "stateMutability": "view", "type": "function", "inputs": []}
 ]
+MULTICALL3_ABI_MIN = [
+    {"name":"aggregate3","inputs":[
+        {"components":[
+            {"type":"address","name":"target"},
+            {"type":"bool","name":"allowFailure"},
+            {"type":"bytes","name":"callData"}
+        ],"type":"tuple[]","name":"calls"}
+    ],"outputs":[
+        {"components":[
+            {"type":"bool","name":"success"},
+            {"type":"bytes","name":"returnData"}
+        ],"type":"tuple[]","name":"returnData"}
+    ],"stateMutability":"payable","type":"function"}
+]
 UNIV3_POOL_ABI_MIN = [
     {"name":"slot0","outputs":[
         {"type":"uint160","name":"sqrtPriceX96"},
@@ -71,141 +59,185 @@ UNIV3_POOL_ABI_MIN = [
 ]
 
 # ------------------- helpers -------------------
-def vwap(deq: Deque[Tuple[float, float]]) -> Optional[float]:
-    if not deq: return None
-    num = sum(p * sz for p, sz in deq); den = sum(sz for _, sz in deq)
-    return (num / den) if den else None
+# last N (price, size) pairs as two float64 ring buffers
+class VwapWindow:
+    __slots__ = ("prices", "sizes", "idx", "n")
+
+    def __init__(self, size: int):
+        self.prices = np.zeros(size, np.float64)
+        self.sizes = np.zeros(size, np.float64)
+        self.idx = 0
+        self.n = 0
+
+    def append(self, px: float, sz: float):
+        self.prices[self.idx] = px; self.sizes[self.idx] = sz
+        self.idx = (self.idx + 1) % self.prices.size
+        if self.n < self.prices.size: self.n += 1
+
+    def __len__(self) -> int:
+        return self.n
+
+def vwap(win: VwapWindow) -> Optional[float]:
+    if not win.n: return None
+    v = vwap_f64(win.prices, win.sizes, win.n)
+    return v if v else None
 
 def pct_diff(a: float, b: float) -> Optional[float]:
     if a is None or b is None or b == 0: return None
     return 100.0 * (a - b) / b
 
 # --- executed price decoders (ETH→USDT only) ---
-def v2_price_from_swap(ev_args) -> Optional[Tuple[float, float]]:
-    a0in  = int(ev_args["amount0In"])     # ETH in
-    a1out = int(ev_args["amount1Out"])    # USDT out
+# Most swaps go the other way, so both decoders reject on the raw 32-byte words before ABI-decoding.
+_ZERO_WORD = bytes(32)
+
+def v2_price_from_swap(data: bytes) -> Optional[Tuple[float, float]]:
+    # words: amount0In, amount1In, amount0Out, amount1Out
+    if data[0:32] == _ZERO_WORD or data[96:128] == _ZERO_WORD:
+        return None
+    a0in, _, _, a1out = decode_v2_amounts(np.frombuffer(data, np.uint8))  # ETH in, USDT out
     if a0in > 0 and a1out > 0:
-        eth_in = a0in / 1e18
-        usdt_out = a1out / (10 ** USDT_DECIMALS)
-        px = usdt_out / eth_in if eth_in else float("inf")
+        eth_in = a0in * INV_ETH_SCALE
+        usdt_out = a1out * INV_USDT_SCALE
+        px = usdt_out / eth_in  # a0in > 0 already guards the divide
         return px, eth_in
     return None
 
-def v3_price_from_swap(ev_args) -> Optional[Tuple[float, float]]:
-    a0 = int(ev_args["amount0"])  # ETH (token0), signed
-    a1 = int(ev_args["amount1"])  # USDT (token1), signed
+def v3_price_from_swap(data: bytes) -> Optional[Tuple[float, float]]:
+    # words: amount0, amount1 (int256); high bit of the first byte is the sign
+    if data[0] >= 0x80 or data[32] < 0x80:
+        return None
+    a0, a1 = decode_v3_amounts(np.frombuffer(data, np.uint8))  # ETH (token0), USDT (token1), signed
     # ETH->USDT: pool gets ETH (+), sends USDT (-)
     if a0 > 0 and a1 < 0:
-        eth_in = a0 / 1e18
-        usdt_out = abs(a1) / (10 ** USDT_DECIMALS)
-        px = usdt_out / eth_in if eth_in else float("inf")
+        eth_in = a0 * INV_ETH_SCALE
+        usdt_out = -a1 * INV_USDT_SCALE
+        px = usdt_out / eth_in  # a0 > 0 already guards the divide
         return px, eth_in
     return None
 
-# --- spot price (mid) ---
-def v2_spot_price(w3: Web3) -> float:
-    pair = w3.eth.contract(address=UNISWAP_V2_POOL, abi=UNIV2_PAIR_ABI_MIN)
-    r0, r1, _ = pair.functions.getReserves().call()
-    reserve_eth  = r0 / 1e18
-    reserve_usdt = r1 / (10 ** USDT_DECIMALS)
-    return reserve_usdt / reserve_eth if reserve_eth else float("inf")
-
-def v3_spot_price(w3: Web3) -> float:
-    pool = w3.eth.contract(address=UNISWAP_V3_POOL, abi=UNIV3_POOL_ABI_MIN)
-    sqrtP, *_ = pool.functions.slot0().call()
-    # raw price token1/token0 with no decimals
-    raw = (sqrtP / (2 ** 96)) ** 2
-    # apply decimals: token0=WETH(18), token1=USDT(6) → multiply by 10^(18-6)
-    return raw * (10 ** (WETH_DECIMALS - USDT_DECIMALS))
-
-# ------------------- main -------------------
-def main():
-    w3 = Web3(Web3.WebsocketProvider(INFURA_WSS, websocket_timeout=60))
-    assert w3.is_connected(), "Web3 not connected. Check INFURA_WSS."
-
-    latest = w3.eth.block_number
-    from_block = max(0, latest - 50)
-    print(f"Connected. Latest block {latest}. Starting at {from_block}…")
-
-    # contracts
-    v2 = w3.eth.contract(address=UNISWAP_V2_POOL, abi=[UNIV2_SWAP_EVENT_ABI])
-    v3 = w3.eth.contract(address=UNISWAP_V3_POOL, abi=[UNIV3_SWAP_EVENT_ABI])
+# --- spot price (mid): V2 reserves + V3 slot0 in one eth_call via Multicall3 ---
+_SPOT_CALLS = [
+    (UNISWAP_V2_POOL, False, Web3().eth.contract(abi=UNIV2_PAIR_ABI_MIN).encodeABI(fn_name="getReserves")),
+    (UNISWAP_V3_POOL, False, Web3().eth.contract(abi=UNIV3_POOL_ABI_MIN).encodeABI(fn_name="slot0")),
+]
+_RESERVES_TYPES = ["uint112", "uint112", "uint32"]
+_SLOT0_TYPES = ["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"]
+
+def v3_spot_price_from_sqrtp(sqrtP: int) -> float:
+    # price token1/token0 = (sqrtP / 2^96)^2; token0=WETH(18), token1=USDT(6) → scale by 10^(18-6)
+    # exact big-int product, single rounding on the final int/int division
+    return sqrtP * sqrtP * _V3_NUM_MULT / _V3_DEN
+
+async def spot_prices_batched(w3: AsyncWeb3) -> Tuple[float, float]:
+    mc = w3.eth.contract(address=MULTICALL3, abi=MULTICALL3_ABI_MIN)
+    (_, v2_ret), (_, v3_ret) = await mc.functions.aggregate3(_SPOT_CALLS).call()
+
+    r0, r1, _ = decode(_RESERVES_TYPES, v2_ret)
+    reserve_eth  = r0 / ETH_SCALE
+    reserve_usdt = r1 / USDT_SCALE
+    v2 = reserve_usdt / reserve_eth if reserve_eth else float("inf")
+
+    sqrtP, *_ = decode(_SLOT0_TYPES, v3_ret)
+    return v2, v3_spot_price_from_sqrtp(sqrtP)
+
+# ------------------- streams -------------------
+# One subscription over both pools; topic0 alone would do here, but keying on the pool
+# as well keeps the dispatch exact if more pools are added.
+HANDLERS = {
+    (UNISWAP_V2_POOL, bytes.fromhex(V2_SWAP_TOPIC[2:])): ("V2", v2_price_from_swap),
+    (UNISWAP_V3_POOL, bytes.fromhex(V3_SWAP_TOPIC[2:])): ("V3", v3_price_from_swap),
+}
+WATCHED_ADDRESSES = frozenset(address for address, _ in HANDLERS)
+LOGS_FILTER = {
+    "address": sorted(WATCHED_ADDRESSES),
+    "topics": [[V2_SWAP_TOPIC, V3_SWAP_TOPIC]],  # topic0 is any of these
+}
 
-    # topics + filters
-    v2_topic = w3.keccak(text="Swap(address,uint256,uint256,uint256,uint256,address)").hex()
-    v3_topic = w3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)").hex()
-    v2_f = w3.eth.filter({"fromBlock": from_block, "address": UNISWAP_V2_POOL, "topics": [v2_topic]})
-    v3_f = w3.eth.filter({"fromBlock": from_block, "address": UNISWAP_V3_POOL, "topics": [v3_topic]})
+async def run_stream(out: asyncio.Queue, stream: LogStream):
+    async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(INFURA_WSS)) as w3:
+        async for ev in stream.logs(w3):
+            handler = HANDLERS.get((ev["address"], ev["topics"][0]))
+            if handler is None:
+                continue
+            name, price_from_swap = handler
+            res = price_from_swap(ev["data"])
+            if res:
+                out.put_nowait((name, *res, ev["blockNumber"]))
+    raise ConnectionError("subscription closed")
+
+async def printer(q: asyncio.Queue, wins: Dict[str, VwapWindow]):
+    # executed swaps (ETH->USDT only) + rolling VWAPs; each burst of queued swaps is one record (one stdout write)
+    while True:
+        out: List[str] = []
+        item = await q.get()
+        while True:
+            name, px, eth_sz, blk = item
+            win = wins[name]
+            win.append(px, eth_sz)
+            out.append(f"[{name}] {eth_sz:.6f} ETH → @ {px:,.2f} USDT/ETH  (blk {blk})")
+            out.append(f"  ↳ {name} VWAP (last {len(win)}): {vwap(win):,.2f} USDT/ETH")
+            if q.empty(): break
+            item = q.get_nowait()
+        log.info("\n".join(out))
+
+async def spot_loop(wins: Dict[str, VwapWindow]):
+    # Periodic spot (and compare) over a kept-alive HTTPS session, decoupled from the WSS streams
+    async with ClientSession(connector=TCPConnector(limit=4)) as session:
+        provider = AsyncHTTPProvider(INFURA_HTTPS, request_kwargs={"timeout": ClientTimeout(total=10)})
+        await provider.cache_async_session(session)
+        w3 = AsyncWeb3(provider)
+        while True:
+            v2_v = vwap(wins["V2"])
+            v3_v = vwap(wins["V3"])
+            try:
+                # both pools read from the same block, so V2/V3 spot never skew
+                spot_v2, spot_v3 = await spot_prices_batched(w3)
+            except Exception as e:
+                log.warning(f"  [spot] failed: {e}")
+            else:
+                out = [f"  ↳ V3 Spot (slot0): {spot_v3:,.2f} USDT/ETH"]
+                if v3_v is not None:
+                    d = pct_diff(v3_v, spot_v3)
+                    if d is not None and abs(d) > DEVIATION_WARN_PCT:
+                        out.append(f"    ⚠ VWAP vs Spot dev: {d:+.2f}%")
+
+                out.append(f"  ↳ V2 Spot (reserves): {spot_v2:,.2f} USDT/ETH")
+                if v2_v is not None:
+                    d = pct_diff(v2_v, spot_v2)
+                    if d is not None and abs(d) > DEVIATION_WARN_PCT:
+                        out.append(f"    ⚠ VWAP vs Spot dev: {d:+.2f}%")
+                log.info("\n".join(out))
+
+            await asyncio.sleep(SPOT_INTERVAL_SEC)
 
+# ------------------- main -------------------
+async def supervise():
     # vwap windows
-    v2_win: Deque[Tuple[float, float]] = deque(maxlen=VWAP_WINDOW)
-    v3_win: Deque[Tuple[float, float]] = deque(maxlen=VWAP_WINDOW)
+    wins: Dict[str, VwapWindow] = {name: VwapWindow(VWAP_WINDOW) for name, _ in HANDLERS.values()}
 
-    last_spot_t = 0.0
+    q: asyncio.Queue = asyncio.Queue()
+    printer_task = asyncio.create_task(printer(q, wins))
+    stream = LogStream(LOGS_FILTER)
+    tasks = {asyncio.create_task(run_stream(q, stream)): "stream", asyncio.create_task(spot_loop(wins)): "spot"}
+    log.info("Connecting streams…")
 
     while True:
-        try:
-            # V2 executed swaps (ETH->USDT only)
-            for log in v2_f.get_new_entries():
-                ev = v2.events.Swap().process_log(log)
-                res = v2_price_from_swap(ev["args"])
-                if not res: continue
-                px, eth_sz = res
-                v2_win.append((px, eth_sz))
-                print(f"[V2] {eth_sz:.6f} ETH → @ {px:,.2f} USDT/ETH  (blk {log['blockNumber']})")
-
-            # V3 executed swaps (ETH->USDT only)
-            for log in v3_f.get_new_entries():
-                ev = v3.events.Swap().process_log(log)
-                res = v3_price_from_swap(ev["args"])
-                if not res: continue
-                px, eth_sz = res
-                v3_win.append((px, eth_sz))
-                print(f"[V3] {eth_sz:.6f} ETH → @ {px:,.2f} USDT/ETH  (blk {log['blockNumber']})")
-
-            # Rolling VWAPs
-            v2_v = vwap(v2_win)
-            v3_v = vwap(v3_win)
-            if v2_v is not None:
-                print(f"  ↳ V2 VWAP (last {len(v2_win)}): {v2_v:,.2f} USDT/ETH")
-            if v3_v is not None:
-                print(f"  ↳ V3 VWAP (last {len(v3_win)}): {v3_v:,.2f} USDT/ETH")
-
-            # Periodic spot (and compare)
-            now = time.time()
-            if now - last_spot_t >= SPOT_INTERVAL_SEC:
-                try:
-                    spot_v3 = v3_spot_price(w3)
-                    print(f"  ↳ V3 Spot (slot0): {spot_v3:,.2f} USDT/ETH")
-                    if v3_v is not None:
-                        d = pct_diff(v3_v, spot_v3)
-                        if d is not None and abs(d) > DEVIATION_WARN_PCT:
-                            print(f"    ⚠ VWAP vs Spot dev: {d:+.2f}%")
-                except Exception as e:
-                    print(f"  [spot] V3 failed: {e}")
-
-                try:
-                    spot_v2 = v2_spot_price(w3)
-                    print(f"  ↳ V2 Spot (reserves): {spot_v2:,.2f} USDT/ETH")
-                    if v2_v is not None:
-                        d = pct_diff(v2_v, spot_v2)
-                        if d is not None and abs(d) > DEVIATION_WARN_PCT:
-                            print(f"    ⚠ VWAP vs Spot dev: {d:+.2f}%")
-                except Exception as e:
-                    print(f"  [spot] V2 failed: {e}")
-
-                last_spot_t = now
-
-            time.sleep(2)
-
-        except Exception as e:
-            print(f"[Warn] loop error: {e}. Reconnecting in 5s…")
-            time.sleep(5)
-            w3 = Web3(Web3.WebsocketProvider(INFURA_WSS, websocket_timeout=60))
-            v2 = w3.eth.contract(address=UNISWAP_V2_POOL, abi=[UNIV2_SWAP_EVENT_ABI])
-            v3 = w3.eth.contract(address=UNISWAP_V3_POOL, abi=[UNIV3_SWAP_EVENT_ABI])
-            v2_f = w3.eth.filter({"fromBlock": w3.eth.block_number-10, "address": UNISWAP_V2_POOL, "topics": [v2_topic]})
-            v3_f = w3.eth.filter({"fromBlock": w3.eth.block_number-10, "address": UNISWAP_V3_POOL, "topics": [v3_topic]})
+        done, _ = await asyncio.wait([printer_task, *tasks], return_when=asyncio.FIRST_EXCEPTION)
+        if printer_task in done:
+            printer_task.result()  # re-raise; printer never returns on its own
+        for t in done:
+            # only the failed stream is recreated
+            name = tasks.pop(t)
+            log.warning(f"[Warn] {name} error: {t.exception()}. Reconnecting in 5s…")
+            coro = spot_loop(wins) if name == "spot" else run_stream(q, stream)
+            tasks[asyncio.create_task(reconnect_after(5, coro))] = name
+
+def main():
+    listener = start_log_listener()
+    try:
+        asyncio.run(supervise())
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
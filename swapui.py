@@ -1,20 +1,32 @@
 # swapui.py
 # Streamlit Uniswap ETH/USDT dashboard (V2 & V3)
 
+import asyncio
+import logging
 import os
+import random
 import time
 import threading
 from collections import deque
 from dataclasses import dataclass
-from typing import Deque, Tuple, Optional, Dict, List
+from functools import partial
+from operator import attrgetter
+from typing import Deque, Tuple, Optional, Dict, List, Set
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import streamlit as st
 from dotenv import load_dotenv
-from web3 import Web3
+from eth_abi import decode
+from eth_abi.exceptions import DecodingError
+from hexbytes import HexBytes
+from web3 import AsyncWeb3, Web3, WebsocketProviderV2
+from web3.exceptions import (BadFunctionCallOutput, BlockNotFound, ContractLogicError,
+                             ExtraDataLengthError, ProviderConnectionError)
+from websockets.exceptions import ConnectionClosed
 
 # -------------------- Config --------------------
+log = logging.getLogger("swapui")
 st.set_page_config(page_title="Uniswap ETH/USDT — V2 & V3", layout="wide")
 load_dotenv()  # local .env support
 
@@ -26,41 +38,36 @@ if not INFURA_WSS:
 
 USDT_DECIMALS = 6
 WETH_DECIMALS = 18
+# Scale factors as floats, hoisted out of the per-swap / per-spot paths
+_ETH_SCALE = float(10 ** WETH_DECIMALS)
+_USDT_SCALE = float(10 ** USDT_DECIMALS)
+_V3_DECIMAL_ADJ = float(10 ** (WETH_DECIMALS - USDT_DECIMALS))
+_INV_TWO96_SQ = 1.0 / float(1 << 96) ** 2
+
 VWAP_WINDOW = 30           # number of recent swaps to include in VWAP
-SPOT_REFRESH_SEC = 2       # how often to refresh spot call
-POLL_SLEEP_SEC = 1        # event polling interval
+PUBLISH_SEC = 1            # max staleness of the snapshot the UI reads
+BACKFILL_BLOCKS = 50       # history loaded once, right after the first subscribe
+GET_LOGS_STRIDE = 100      # max block span per eth_getLogs call
+SEEN_LOGS = 2048           # recent (txHash, logIndex) keys kept to dedupe catch-up vs live logs
+RECENT_EXECS = 20          # rows in the executed-swaps table
+SERIES_LEN = 600           # chart points kept, one per block (~2 h on mainnet)
 
 # Mainnet pools: token0=WETH, token1=USDT
 UNISWAP_V2_POOL = Web3.to_checksum_address("0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852")
 UNISWAP_V3_POOL = Web3.to_checksum_address("0x11b815efB8f581194ae79006d24E0d814B7697F6")  # 0.05%
 
-UNIV2_SWAP_EVENT_ABI = {
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True,  "name": "sender",    "type": "address"},
-        {"indexed": False, "name": "amount0In", "type": "uint256"},
-        {"indexed": False, "name": "amount1In", "type": "uint256"},
-        {"indexed": False, "name": "amount0Out","type": "uint256"},
-        {"indexed": False, "name": "amount1Out","type": "uint256"},
-        {"indexed": True,  "name": "to",        "type": "address"},
-    ],
-    "name": "Swap",
-    "type": "event",
-}
-UNIV3_SWAP_EVENT_ABI = {
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True,  "name": "sender",        "type": "address"},
-        {"indexed": True,  "name": "recipient",     "type": "address"},
-        {"indexed": False, "name": "amount0",       "type": "int256"},
-        {"indexed": False, "name": "amount1",       "type": "int256"},
-        {"indexed": False, "name": "sqrtPriceX96",  "type": "uint160"},
-        {"indexed": False, "name": "liquidity",     "type": "uint128"},
-        {"indexed": False, "name": "tick",          "type": "int24"},
-    ],
-    "name": "Swap",
-    "type": "event",
-}
+# Swap event topic0 = keccak of the signature (constants; web3 hex-encodes HexBytes params itself)
+V2_SWAP_TOPIC = HexBytes("0xd78ad95fa46c994b6551d0da85fc275fe613ce37657fb8d5e3d130840159d822")  # Swap(address,uint256,uint256,uint256,uint256,address)
+V3_SWAP_TOPIC = HexBytes("0xc42079f94a6350d7e6235f29174924f928cc2ac818eb64fed8004e115fbcca67")  # Swap(address,address,int256,int256,uint160,uint128,int24)
+
+# Both pools in one logs filter: any of the addresses, topic0 any of the Swap signatures
+SWAPS_FILTER = {"address": [UNISWAP_V2_POOL, UNISWAP_V3_POOL], "topics": [[V2_SWAP_TOPIC, V3_SWAP_TOPIC]]}
+
+# Swap event data (non-indexed fields only; sender/to/recipient are topics)
+V2_NONIDX = ("uint256", "uint256", "uint256", "uint256")          # amount0In, amount1In, amount0Out, amount1Out
+V3_NONIDX = ("int256", "int256", "uint160", "uint128", "int24")   # amount0, amount1, sqrtPriceX96, liquidity, tick
+_v2_decode = partial(decode, V2_NONIDX)
+_v3_decode = partial(decode, V3_NONIDX)
 UNIV2_PAIR_ABI_MIN = [
     {"name": "getReserves", "outputs": [
         {"type": "uint112", "name": "_reserve0"},
@@ -80,200 +87,403 @@ UNIV3_POOL_ABI_MIN = [
     ],"stateMutability":"view","type":"function","inputs":[]}
 ]
 
+# Multicall3 (same address on every chain): both spot reads in one eth_call
+MULTICALL3 = Web3.to_checksum_address("0xcA11bde05977b3631167028862bE2a173976CA11")
+MULTICALL3_ABI_MIN = [
+    {"name":"aggregate3","inputs":[
+        {"components":[
+            {"type":"address","name":"target"},
+            {"type":"bool","name":"allowFailure"},
+            {"type":"bytes","name":"callData"}
+        ],"type":"tuple[]","name":"calls"}
+    ],"outputs":[
+        {"components":[
+            {"type":"bool","name":"success"},
+            {"type":"bytes","name":"returnData"}
+        ],"type":"tuple[]","name":"returnData"}
+    ],"stateMutability":"payable","type":"function"}
+]
+# spot calldata never changes: encoded once, offline (the aggregate3 call is bound per
+# subscription connection, see Engine._subscribe)
+SPOT_CALLS = [
+    (UNISWAP_V2_POOL, False, Web3().eth.contract(abi=UNIV2_PAIR_ABI_MIN).encodeABI(fn_name="getReserves")),
+    (UNISWAP_V3_POOL, False, Web3().eth.contract(abi=UNIV3_POOL_ABI_MIN).encodeABI(fn_name="slot0")),
+]
+RESERVES_TYPES = ["uint112", "uint112", "uint32"]
+SLOT0_TYPES = ["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"]
+
+# Error classes: bad data skips one event/tick, a dead connection reconnects with backoff
+DATA_ERRORS = (DecodingError, BlockNotFound, ExtraDataLengthError, ContractLogicError, BadFunctionCallOutput)
+CONN_ERRORS = (ConnectionError, ConnectionClosed, ProviderConnectionError, TimeoutError, OSError)
+
+def backoff_delay(attempt: int) -> float:
+    # 0.5s, 1s, 2s, … capped at 30s; jittered so restarts across sessions don't line up. The exponent
+    # is capped too: a day-long outage reaches attempt 1024, where 2.0 ** attempt overflows
+    return min(30.0, 0.5 * 2 ** min(attempt, 6) * random.uniform(0.5, 1.5))
+
 # -------------------- Data model --------------------
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ExecTrade:
     ts: float
     block: int
     pool: str
     eth_size: float
     price: float      # USDT/ETH
-    tx: str
+    tx: bytes         # raw 32-byte hash; hex only when rendered
 
 # -------------------- Math helpers --------------------
-def vwap(items: Deque[Tuple[float, float]]) -> Optional[float]:
-    if not items:
-        return None
-    num = sum(p * sz for p, sz in items)
-    den = sum(sz for _, sz in items)
-    return (num / den) if den else None
-
-def v2_spot_price(w3: Web3) -> float:
-    pair = w3.eth.contract(address=UNISWAP_V2_POOL, abi=UNIV2_PAIR_ABI_MIN)
-    r0, r1, _ = pair.functions.getReserves().call()
-    reserve_eth  = r0 / 1e18
-    reserve_usdt = r1 / (10 ** USDT_DECIMALS)
+class RollingVwap:
+    # Sliding-window VWAP with running sums: O(1) per trade and per read
+    __slots__ = ("buf", "num", "den")
+
+    def __init__(self, size: int):
+        self.buf: Deque[Tuple[float, float]] = deque(maxlen=size)  # (price, eth)
+        self.num = 0.0
+        self.den = 0.0
+
+    def add(self, px: float, sz: float):
+        if len(self.buf) == self.buf.maxlen:
+            op, osz = self.buf.popleft()
+            self.num -= op * osz
+            self.den -= osz
+        self.buf.append((px, sz))
+        self.num += px * sz
+        self.den += sz
+
+    def value(self) -> Optional[float]:
+        return (self.num / self.den) if self.buf and self.den > 0 else None
+
+def v2_spot_from_reserves(ret: bytes) -> float:
+    r0, r1, _ = decode(RESERVES_TYPES, ret)
+    reserve_eth  = r0 / _ETH_SCALE
+    reserve_usdt = r1 / _USDT_SCALE
     return reserve_usdt / reserve_eth if reserve_eth else float("inf")
 
-def v3_spot_price(w3: Web3) -> float:
-    pool = w3.eth.contract(address=UNISWAP_V3_POOL, abi=UNIV3_POOL_ABI_MIN)
-    sqrtP, *_ = pool.functions.slot0().call()
-    raw = (sqrtP / (2 ** 96)) ** 2              # token1/token0, no decimals
-    return raw * (10 ** (WETH_DECIMALS - USDT_DECIMALS))  # multiply by 1e12
+def v3_spot_from_slot0(ret: bytes) -> float:
+    sqrtP, *_ = decode(SLOT0_TYPES, ret)
+    # (sqrtP / 2^96)^2 = token1/token0 without decimals, then scale by 1e12
+    return (sqrtP * sqrtP) * _INV_TWO96_SQ * _V3_DECIMAL_ADJ
 
-def v2_price_from_swap(args) -> Optional[Tuple[float, float]]:
-    a0in  = int(args["amount0In"])   # ETH in
-    a1out = int(args["amount1Out"])  # USDT out
+def v2_price_from_swap(a0in: int, a1out: int) -> Optional[Tuple[float, float]]:
+    # a0in: ETH in, a1out: USDT out
     if a0in > 0 and a1out > 0:       # ETH -> USDT
-        eth = a0in / 1e18
-        usdt = a1out / (10 ** USDT_DECIMALS)
-        return usdt / eth, eth
+        eth = a0in / _ETH_SCALE
+        return (a1out / _USDT_SCALE) / eth, eth
     return None
 
-def v3_price_from_swap(args) -> Optional[Tuple[float, float]]:
-    a0 = int(args["amount0"])  # ETH, signed
-    a1 = int(args["amount1"])  # USDT, signed
+def v3_price_from_swap(a0: int, a1: int) -> Optional[Tuple[float, float]]:
+    # a0: ETH, a1: USDT, both signed (pool's perspective)
     if a0 > 0 and a1 < 0:      # ETH -> USDT
-        eth = a0 / 1e18
-        usdt = abs(a1) / (10 ** USDT_DECIMALS)
-        return usdt / eth, eth
+        eth = a0 / _ETH_SCALE
+        return (-a1 / _USDT_SCALE) / eth, eth
     return None
 
+async def ws_reachable(wss_url: str) -> bool:
+    # one short-lived connection; the context manager closes it on the way out
+    async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(wss_url)) as w3:
+        return await w3.is_connected()
+
 # -------------------- Engine (background thread) --------------------
 class Engine:
     def __init__(self, wss_url: str):
-        self.w3 = Web3(Web3.WebsocketProvider(wss_url, websocket_timeout=60))
-        if not self.w3.is_connected():
+        self.wss_url = wss_url
+        try:
+            reachable = asyncio.run(ws_reachable(wss_url))
+        except CONN_ERRORS:
+            reachable = False
+        if not reachable:
             raise RuntimeError("Web3 not connected. Check INFURA_WSS.")
-        latest = self.w3.eth.block_number
-        self.from_block = max(0, latest - 50)
-
-        self.v2 = self.w3.eth.contract(address=UNISWAP_V2_POOL, abi=[UNIV2_SWAP_EVENT_ABI])
-        self.v3 = self.w3.eth.contract(address=UNISWAP_V3_POOL, abi=[UNIV3_SWAP_EVENT_ABI])
-
-        self.v2_topic = self.w3.keccak(text="Swap(address,uint256,uint256,uint256,uint256,address)").hex()
-        self.v3_topic = self.w3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)").hex()
 
-        self.v2_filter = self.w3.eth.filter({"fromBlock": self.from_block, "address": UNISWAP_V2_POOL, "topics": [self.v2_topic]})
-        self.v3_filter = self.w3.eth.filter({"fromBlock": self.from_block, "address": UNISWAP_V3_POOL, "topics": [self.v3_topic]})
+        self._handlers = {
+            (UNISWAP_V2_POOL, V2_SWAP_TOPIC): self._on_v2_swap,
+            (UNISWAP_V3_POOL, V3_SWAP_TOPIC): self._on_v3_swap,
+        }
 
+        # RCU-style publishing: the subscription loop mutates under self.lock (it only orders it
+        # against the publisher thread) and bumps self.epoch; every PUBLISH_SEC, if the epoch moved,
+        # a fresh immutable snapshot dict is swapped in. Readers just load self._pub -- one atomic
+        # reference read, never blocking on a writer.
         self.lock = threading.Lock()
-        self.v2_trades: Deque[Tuple[float, float]] = deque(maxlen=VWAP_WINDOW)   # (price, eth)
-        self.v3_trades: Deque[Tuple[float, float]] = deque(maxlen=VWAP_WINDOW)
-        self.recent_execs: Deque[ExecTrade] = deque(maxlen=200)
-        self.series: Deque[Tuple[float, float, float, float]] = deque(maxlen=600)  # ts, v2spot, v3spot, comb_vwap
+        self.epoch = 0
+        self.v2_vwap = RollingVwap(VWAP_WINDOW)
+        self.v3_vwap = RollingVwap(VWAP_WINDOW)
+        self.comb_vwap = RollingVwap(VWAP_WINDOW)  # both pools, fed from both swap paths
+        # newest first (appendleft; maxlen drops the oldest off the right), only what the table shows
+        self.recent_execs: Deque[ExecTrade] = deque(maxlen=RECENT_EXECS)
+        # ring buffer of (ts, v2spot, v3spot, comb_vwap) rows; oldest row at _series_head
+        self._series = np.empty((SERIES_LEN, 4), dtype=np.float64)
+        self._series_len = 0
+        self._series_head = 0
+        self.series_version: int = 0  # bumped on every series append; UI caches keyed on it
         self.v2spot = None
         self.v3spot = None
+        self._series_view = self._series[:0]  # chronological copy, refreshed on each series append
+
+        # (transactionHash, logIndex) of recently dispatched logs: the catch-up eth_getLogs and the
+        # live subscription overlap around the block where one hands over to the other
+        self._seen: Set[Tuple[bytes, int]] = set()
+        self._seen_order: Deque[Tuple[bytes, int]] = deque()
+        self._synced_block: Optional[int] = None  # every swap up to here has been dispatched
+        with self.lock:
+            self._publish()  # initial snapshot, so readers never see a missing _pub
 
         self._stop = False
+        self._sub_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sub_task: Optional[asyncio.Task] = None
         self._t = threading.Thread(target=self._run, daemon=True)
         self._t.start()
-
-    def stop(self): self._stop = True
-
-    def _run(self):
-        last_spot = 0.0
+        # swaps are pushed over eth_subscribe on their own event loop; no filter polling
+        self._sub_t = threading.Thread(target=lambda: asyncio.run(self._subscribe()), daemon=True)
+        self._sub_t.start()
+
+    def stop(self):
+        # both loops check _stop; the subscription task is also cancelled so it doesn't sit in
+        # process_subscriptions until the next swap -- leaving `async with` closes its socket
+        self._stop = True
+        loop, task = self._sub_loop, self._sub_task
+        if loop is not None and task is not None:
+            loop.call_soon_threadsafe(task.cancel)
+
+    async def _backfill(self, w3: AsyncWeb3, first: int, latest: int):
+        # runs on the subscription socket right after subscribing, so no block falls between
+        # history and live; ranges are clamped to GET_LOGS_STRIDE blocks (wide eth_getLogs ranges
+        # get slow on mainnet)
+        for lo in range(max(0, first), latest + 1, GET_LOGS_STRIDE):
+            hi = min(lo + GET_LOGS_STRIDE - 1, latest)
+            for ev in await w3.eth.get_logs({"fromBlock": lo, "toBlock": hi, **SWAPS_FILTER}):
+                self._dispatch(ev)
+
+    def _dispatch(self, log):
+        key = (bytes(log["transactionHash"]), log["logIndex"])
+        if key in self._seen:
+            return  # already delivered by the backfill (or the subscription)
+        self._seen.add(key)
+        self._seen_order.append(key)
+        if len(self._seen_order) > SEEN_LOGS:
+            self._seen.discard(self._seen_order.popleft())
+        # (pool, topic0) -> decoder; HexBytes hashes like bytes, so the lookup is exact
+        on_swap = self._handlers.get((log["address"], log["topics"][0]))
+        if on_swap:
+            on_swap(log)
+
+    def _on_v2_swap(self, log):
+        a0in, _, _, a1out = _v2_decode(log["data"])
+        res = v2_price_from_swap(a0in, a1out)
+        if res:
+            px, eth_sz = res
+            with self.lock:
+                self.v2_vwap.add(px, eth_sz)
+                self.comb_vwap.add(px, eth_sz)
+                self.recent_execs.appendleft(ExecTrade(time.time(), log["blockNumber"], "V2", eth_sz, px, bytes(log["transactionHash"])))
+                self.epoch += 1
+
+    def _on_v3_swap(self, log):
+        a0, a1, *_ = _v3_decode(log["data"])
+        res = v3_price_from_swap(a0, a1)
+        if res:
+            px, eth_sz = res
+            with self.lock:
+                self.v3_vwap.add(px, eth_sz)
+                self.comb_vwap.add(px, eth_sz)
+                self.recent_execs.appendleft(ExecTrade(time.time(), log["blockNumber"], "V3", eth_sz, px, bytes(log["transactionHash"])))
+                self.epoch += 1
+
+    async def _subscribe(self):
+        self._sub_loop, self._sub_task = asyncio.get_running_loop(), asyncio.current_task()
+        attempt = 0
         while not self._stop:
             try:
-                # V2 swaps
-                for log in self.v2_filter.get_new_entries():
-                    ev = self.v2.events.Swap().process_log(log)
-                    res = v2_price_from_swap(ev["args"])
-                    if res:
-                        px, eth_sz = res
-                        with self.lock:
-                            self.v2_trades.append((px, eth_sz))
-                            self.recent_execs.append(ExecTrade(time.time(), log["blockNumber"], "V2", eth_sz, px, ev["transactionHash"].hex()))
-
-                # V3 swaps
-                for log in self.v3_filter.get_new_entries():
-                    ev = self.v3.events.Swap().process_log(log)
-                    res = v3_price_from_swap(ev["args"])
-                    if res:
-                        px, eth_sz = res
-                        with self.lock:
-                            self.v3_trades.append((px, eth_sz))
-                            self.recent_execs.append(ExecTrade(time.time(), log["blockNumber"], "V3", eth_sz, px, ev["transactionHash"].hex()))
-
-                # Spot refresh
-                now = time.time()
-                if now - last_spot >= SPOT_REFRESH_SEC:
-                    v2s = v2_spot_price(self.w3)
-                    v3s = v3_spot_price(self.w3)
-                    comb = vwap(deque(list(self.v2_trades) + list(self.v3_trades), maxlen=VWAP_WINDOW))
-                    with self.lock:
-                        self.v2spot = v2s
-                        self.v3spot = v3s
-                        self.series.append((now, v2s, v3s, comb if comb else float("nan")))
-                    last_spot = now
-
-                time.sleep(POLL_SLEEP_SEC)
-
+                async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(self.wss_url)) as w3:
+                    # reserves/slot0 only change per block: refresh spot on each new head, over the
+                    # same socket (one aggregate3 eth_call per block)
+                    spot_batch = w3.eth.contract(address=MULTICALL3, abi=MULTICALL3_ABI_MIN).functions.aggregate3(SPOT_CALLS)
+                    head_sub = await w3.eth.subscribe("newHeads")
+                    await w3.eth.subscribe("logs", SWAPS_FILTER)
+                    # catch up to the first live block: recent history on the first connect,
+                    # everything mined during the outage + backoff on a reconnect. Live messages
+                    # are buffered meanwhile, and any overlap is deduped in _dispatch.
+                    latest = await w3.eth.block_number
+                    if self._synced_block is None:
+                        start = latest - BACKFILL_BLOCKS
+                    else:
+                        start = self._synced_block + 1
+                        log.info("resubscribed; catching up blocks %d..%d", start, latest)
+                    await self._backfill(w3, start, latest)
+                    self._synced_block = max(self._synced_block or 0, latest)
+                    attempt = 0
+                    async for payload in w3.ws.process_subscriptions():
+                        if payload["subscription"] == head_sub:
+                            try:
+                                head = payload["result"]
+                                self._synced_block = max(self._synced_block, head["number"] - 1)
+                                await self._on_head(spot_batch, head)
+                            except Exception as e:
+                                # any spot failure (RPC error reply, rate limit, bad data) skips this
+                                # head only; it must never take the swap stream down with it
+                                log.warning("spot refresh skipped (%s: %s)", type(e).__name__, e)
+                        else:
+                            ev = payload["result"]
+                            # block n may still have logs in flight; n-1 is complete
+                            self._synced_block = max(self._synced_block, ev["blockNumber"] - 1)
+                            try:
+                                self._dispatch(ev)
+                            except DATA_ERRORS as e:
+                                # one undecodable log: skip it, keep the socket
+                                log.warning("swap log skipped (%s: %s)", type(e).__name__, e)
+                        if self._stop:
+                            return
+                log.warning("subscription closed by server")
+            except asyncio.CancelledError:
+                return  # stop()
+            except CONN_ERRORS as e:
+                log.warning("subscription connection error (%s: %s)", type(e).__name__, e)
             except Exception:
-                # Basic reconnect
-                time.sleep(5)
-                try:
-                    self.w3 = Web3(Web3.WebsocketProvider(INFURA_WSS, websocket_timeout=60))
-                    self.v2 = self.w3.eth.contract(address=UNISWAP_V2_POOL, abi=[UNIV2_SWAP_EVENT_ABI])
-                    self.v3 = self.w3.eth.contract(address=UNISWAP_V3_POOL, abi=[UNIV3_SWAP_EVENT_ABI])
-                    self.v2_filter = self.w3.eth.filter({"fromBlock": self.w3.eth.block_number-10, "address": UNISWAP_V2_POOL, "topics": [self.v2_topic]})
-                    self.v3_filter = self.w3.eth.filter({"fromBlock": self.w3.eth.block_number-10, "address": UNISWAP_V3_POOL, "topics": [self.v3_topic]})
-                except Exception:
-                    pass
+                log.exception("subscription failed unexpectedly")
+            delay = backoff_delay(attempt)
+            attempt += 1
+            log.info("resubscribing in %.1fs (attempt %d)", delay, attempt)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                return  # stop()
+
+    async def _on_head(self, spot_batch, head):
+        (_, v2_ret), (_, v3_ret) = await spot_batch.call()
+        v2s = v2_spot_from_reserves(v2_ret)
+        v3s = v3_spot_from_slot0(v3_ret)
+        with self.lock:
+            comb = self.comb_vwap.value()
+            self.v2spot = v2s
+            self.v3spot = v3s
+            # x-axis is the block timestamp: monotone and independent of the host clock
+            i = (self._series_head + self._series_len) % SERIES_LEN
+            self._series[i] = (head["timestamp"], v2s, v3s, comb if comb else np.nan)
+            if self._series_len < SERIES_LEN:
+                self._series_len += 1
+            else:
+                self._series_head = (self._series_head + 1) % SERIES_LEN
+            self.series_version += 1
+            idx = (self._series_head + np.arange(self._series_len)) % SERIES_LEN
+            self._series_view = self._series[idx]  # fancy indexing copies
+            self.epoch += 1
+
+    def _run(self):
+        # publisher: one snapshot per PUBLISH_SEC covering every swap/head since the last one,
+        # and only if anything landed
+        while not self._stop:
+            with self.lock:
+                if self.epoch != self._pub["epoch"]:
+                    self._publish()
+            time.sleep(PUBLISH_SEC)
+
+    def _publish(self):
+        # caller holds self.lock; everything in the dict is a fresh copy, never mutated afterwards
+        self._pub = {
+            "v2_vwap": self.v2_vwap.value(),
+            "v3_vwap": self.v3_vwap.value(),
+            "v2_spot": self.v2spot,
+            "v3_spot": self.v3spot,
+            "execs": list(self.recent_execs),  # already newest first
+            "series_version": self.series_version,
+            "epoch": self.epoch,
+            "series": self._series_view,
+        }
 
     def snapshot(self) -> Dict:
-        with self.lock:
-            v2_v = vwap(self.v2_trades)
-            v3_v = vwap(self.v3_trades)
-            execs = list(self.recent_execs)[-20:][::-1]  # last 20, newest first
-            df = pd.DataFrame(self.series, columns=["ts", "V2 Spot", "V3 Spot", "Combined VWAP"])
-        return {"v2_vwap": v2_v, "v3_vwap": v3_v, "v2_spot": self.v2spot, "v3_spot": self.v3spot, "execs": execs, "chart_df": df}
+        return self._pub
 
 # -------------------- UI --------------------
-@st.cache_resource
+# One engine per process. When it is evicted or replaced (TTL, cache clear), on_release stops its
+# threads and closes its subscription socket instead of leaving a zombie engine behind.
+@st.cache_resource(max_entries=1, ttl="24h", on_release=lambda eng: eng.stop())
 def get_engine():
     return Engine(INFURA_WSS)
 
 st.title("Uniswap ETH ⇄ USDT — Live (V2 & V3)")
 st.caption("Executed ETH→USDT trades (VWAP) and mid spot from pool state (V2 reserves, V3 slot0)")
 
-eng = get_engine()
-snap = eng.snapshot()
-
-colA, colB, colC, colD = st.columns(4)
-colA.metric("V3 Spot (slot0)", f"{(snap['v3_spot'] or float('nan')):,.2f} USDT/ETH")
-colB.metric("V2 Spot (reserves)", f"{(snap['v2_spot'] or float('nan')):,.2f} USDT/ETH")
-colC.metric(f"V3 VWAP (last {VWAP_WINDOW})", f"{(snap['v3_vwap'] or float('nan')):,.2f} USDT/ETH")
-colD.metric(f"V2 VWAP (last {VWAP_WINDOW})", f"{(snap['v2_vwap'] or float('nan')):,.2f} USDT/ETH")
-
-st.subheader("Spot & Combined VWAP")
-df = snap["chart_df"]
-if not df.empty:
-    df = df.copy()
-    df["time"] = pd.to_datetime(df["ts"], unit="s")
-    fig = px.line(df, x="time", y=["V2 Spot", "V3 Spot", "Combined VWAP"])
-    fig.update_layout(height=340, margin=dict(l=20, r=20, t=10, b=10))
-    st.plotly_chart(fig, use_container_width=True)
-else:
-    st.info("Warming up… collecting initial data.")
+# Cached across reruns: only rebuilt when the engine has appended a point (or the exec list changed).
+# Underscore args are not hashed by Streamlit, so a cache hit costs one int/tuple compare.
+@st.cache_data(ttl=60, max_entries=4)
+def build_chart(version: int, _rows: np.ndarray) -> Optional[pd.DataFrame]:
+    # the rows come from the same snapshot as version, so the cache key always matches the content
+    if not len(_rows):
+        return None
+    # time-indexed frame, one column per line, ready for st.line_chart
+    return pd.DataFrame({"V2 Spot": _rows[:, 1], "V3 Spot": _rows[:, 2], "Combined VWAP": _rows[:, 3]},
+                        index=pd.to_datetime(_rows[:, 0], unit="s").rename("time"))
+
+_EXEC_FIELDS = ("ts", "block", "pool", "eth_size", "price", "tx")
+_exec_row = attrgetter(*_EXEC_FIELDS)  # ExecTrade -> tuple, in C
+
+@st.cache_data(ttl=60, max_entries=4)
+def build_execs_table(key: Tuple[int, float], _execs: List[ExecTrade]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(map(_exec_row, _execs), columns=_EXEC_FIELDS)
+    # whole-column formatting; shift by the local UTC offset to match time.localtime
+    df["When"] = pd.to_datetime(df["ts"] + time.localtime().tm_gmtoff, unit="s").dt.strftime("%H:%M:%S")
+    df["ETH Size"] = df["eth_size"].round(6)
+    df["Price (USDT/ETH)"] = df["price"].round(2)
+    df["Tx"] = "0x" + df["tx"].map(bytes.hex).str.slice(0, 8) + "…"
+    df = df.rename(columns={"pool": "Pool", "block": "Block"})
+    return df[["When", "Pool", "ETH Size", "Price (USDT/ETH)", "Block", "Tx"]]
+
+def session_memo(name: str, epoch: int, build):
+    # per-session early-out: a tick where the engine's epoch hasn't moved reuses the last object
+    # as-is (no cache_data hashing or unpickling)
+    ss = st.session_state
+    if ss.get(name + "_epoch") != epoch:
+        ss[name] = build()
+        ss[name + "_epoch"] = epoch
+    return ss[name]
+
+# fail fast on a bad endpoint; the fragments call get_engine() on every run themselves, so a
+# timed rerun after on_release stopped an engine picks up the new one instead of polling a dead one
+get_engine()
 
-st.subheader("Recent Executed ETH→USDT Swaps")
-execs = snap["execs"]
-if execs:
-    data = [{
-        "When": time.strftime("%H:%M:%S", time.localtime(e.ts)),
-        "Pool": e.pool,
-        "ETH Size": round(e.eth_size, 6),
-        "Price (USDT/ETH)": round(e.price, 2),
-        "Block": e.block,
-        "Tx": e.tx[:10] + "…"
-    } for e in execs]
-    st.dataframe(pd.DataFrame(data), use_container_width=True, height=360)
-else:
-    st.write("No swaps yet in the window…")
-
-# Soft auto-refresh by pinging snapshot periodically
-# --- Auto-refresh (simple + reliable) ---
-# You can tweak the interval in seconds from the sidebar.
-# --- Auto-refresh (simple + reliable) ---
 with st.sidebar:
     st.markdown("### Live refresh")
     refresh_enabled = st.toggle("Auto refresh", value=True)
     # Cloud can get unhappy with super-fast loops; 3–10s is a good range
     refresh_secs = st.number_input("Interval (seconds)", min_value=1, max_value=30, value=5, step=1)
 
-st.caption("App auto-updates continuously.")
-if refresh_enabled:
-    time.sleep(int(refresh_secs))
-    st.rerun()   # <-- use this (not st.experimental_rerun)
+# Title and sidebar render once per session; only the fragments below re-run on the timer,
+# scheduled by Streamlit itself (no sleeping script thread, no full-page rerun).
+run_every = f"{int(refresh_secs)}s" if refresh_enabled else None
+
+@st.fragment(run_every=run_every)
+def metrics_frag():
+    snap = get_engine().snapshot()
+    colA, colB, colC, colD = st.columns(4)
+    colA.metric("V3 Spot (slot0)", f"{(snap['v3_spot'] or float('nan')):,.2f} USDT/ETH")
+    colB.metric("V2 Spot (reserves)", f"{(snap['v2_spot'] or float('nan')):,.2f} USDT/ETH")
+    colC.metric(f"V3 VWAP (last {VWAP_WINDOW})", f"{(snap['v3_vwap'] or float('nan')):,.2f} USDT/ETH")
+    colD.metric(f"V2 VWAP (last {VWAP_WINDOW})", f"{(snap['v2_vwap'] or float('nan')):,.2f} USDT/ETH")
+
+@st.fragment(run_every=run_every)
+def chart_frag():
+    snap = get_engine().snapshot()
+    df = session_memo("chart", snap["epoch"], lambda: build_chart(snap["series_version"], snap["series"]))
+    if df is not None:
+        st.line_chart(df, height=340)
+    else:
+        st.info("Warming up… collecting initial data.")
+
+@st.fragment(run_every=run_every)
+def execs_frag():
+    snap = get_engine().snapshot()
+    execs = snap["execs"]
+    if execs:
+        table = session_memo("execs", snap["epoch"], lambda: build_execs_table((len(execs), execs[0].ts), execs))
+        st.dataframe(table, use_container_width=True, height=360)
+    else:
+        st.write("No swaps yet in the window…")
+
+metrics_frag()
+
+st.subheader("Spot & Combined VWAP")
+chart_frag()
+
+st.subheader("Recent Executed ETH→USDT Swaps")
+execs_frag()
 
+st.caption("App auto-updates continuously.")